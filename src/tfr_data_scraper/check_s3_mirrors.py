@@ -0,0 +1,167 @@
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from common.logger import Logger as L
+from common.mirror_pool import MirrorPool
+from common.transport import Transport
+from common.time_helper import format_time
+from s3_demagnetize_hash import _download_torrent
+
+# Stand-in cache server for s3_demagnetize_hash. Each mirror is served under its own path (http://127.0.0.1:<port>/<mirror>/)
+# with injected delays and 404s, so that hedged fetching through MirrorPool can be checked without touching a real cache.
+# Every limit checked below is derived from the injected delays.
+# Run from this directory: python check_s3_mirrors.py
+
+TORRENT = b"d4:infod4:name8:test.mkv6:lengthi1eee"  # A minimal bencoded .torrent body
+TORRENT_HASH = "0123456789ABCDEF0123456789ABCDEF01234567"
+
+BACKUP_DELAY = 0.05  # Delay of the always available backup mirror
+FAST_DELAY = 0.02  # Delay of a fast answer from the flaky mirror
+SLOW_DELAY = 0.5  # Delay of a slow answer from the flaky mirror
+STALL_DELAY = 3.0  # Delay of the stalled mirror
+HEDGE_DELAY = 0.2  # Initial hedge delay of the pools
+
+
+class _MirrorHandler(BaseHTTPRequestHandler):
+    """
+    Serves TORRENT with the delay and status of the mirror named in the first path segment.
+    """
+
+    protocol_version = "HTTP/1.1"
+    request_counts = {}  # mirror -> number of requests received
+    _lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass  # Keep the check output readable
+
+    def do_GET(self):
+        mirror = self.path.strip("/").split("/")[0]
+        with _MirrorHandler._lock:
+            n = _MirrorHandler.request_counts.get(mirror, 0)
+            _MirrorHandler.request_counts[mirror] = n + 1
+
+        delay, found = _behaviour(mirror, n)
+        time.sleep(delay)
+        body = TORRENT if found else b"<html>Not Found</html>"
+        try:
+            self.send_response(200 if found else 404)
+            self.send_header("Content-Type", "application/x-bittorrent" if found else "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # The request lost a hedge and was cancelled
+
+
+def _behaviour(mirror: str, n: int) -> (float, bool):
+    """ The injected (delay seconds, found) of the n-th request to a mirror. Deterministic so the check is repeatable.
+    :param mirror: The mirror name.
+    :param n: The number of earlier requests to this mirror.
+    :return: A tuple of the delay and whether the torrent is found.
+    """
+    if mirror == "flaky":  # Every 5th request is a 404, every 3rd is slow
+        return (FAST_DELAY, False) if n % 5 == 4 else (SLOW_DELAY if n % 3 == 2 else FAST_DELAY, True)
+    if mirror == "missing":
+        return 0.0, False
+    if mirror == "stalled":
+        return STALL_DELAY, True
+    if mirror == "degrading":  # Fast at first, then slows down
+        return (FAST_DELAY if n < 10 else 2 * SLOW_DELAY), True
+    return BACKUP_DELAY, True  # "backup"
+
+
+def _check(condition: bool, message: str) -> None:
+    if not condition:
+        raise Exception(f"Check failed: {message}")
+
+
+def _run(mirror_pool: MirrorPool, transport: Transport, fetches: int, finished: dict[str, float] | None = None) -> (list[float], int):
+    """ Fetches the torrent fetches times through the mirror pool.
+    :param finished: If given, filled with the time each mirror's last download attempt returned or raised.
+    :return: A tuple of the sorted fetch latencies and the number of failed fetches.
+    """
+    def fetch_fn(source, cancel_token):
+        try:
+            return _download_torrent(TORRENT_HASH, source, transport, cancel_token)
+        finally:
+            if finished is not None:
+                finished[source] = time.time()
+
+    latencies = []
+    failures = 0
+    for _ in range(fetches):
+        start = time.time()
+        try:
+            content = mirror_pool.fetch(fetch_fn)
+        except Exception:
+            failures += 1
+        else:
+            _check(content == TORRENT, "unexpected torrent content")
+        latencies.append(time.time() - start)
+    return sorted(latencies), failures
+
+
+def _p95(latencies: list[float]) -> float:
+    return latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _MirrorHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}/"
+    transport = Transport(base, timeout=10)
+
+    def mirror_urls(*names: str) -> list[str]:
+        return [f"{base}{name}/" for name in names]
+
+    start_time = time.time()
+    try:
+        # Failover: the primary 404s instantly, so the backup is asked straight away rather than after the hedge delay
+        pool = MirrorPool(mirror_urls("missing", "backup"), initial_hedge_delay=STALL_DELAY)
+        latencies, failures = _run(pool, transport, 1)
+        _check(failures == 0, "failover to the backup failed")
+        _check(latencies[0] < STALL_DELAY, f"failover waited for the hedge delay ({latencies[0]:.2f}s)")
+
+        # Failover while a hedge is in flight: a failed hedge is replaced right away instead of after its hedge delay
+        pool = MirrorPool(mirror_urls("stalled", "missing", "backup"), initial_hedge_delay=STALL_DELAY / 3)
+        latencies, failures = _run(pool, transport, 1)
+        _check(failures == 0, "failover after a hedge failed")
+        _check(latencies[0] < 2 * STALL_DELAY / 3, f"failed hedge waited for its hedge delay ({latencies[0]:.2f}s)")
+
+        # Hedging: the primary stalls, so the backup wins and the stalled request is cancelled rather than left running
+        finished = {}
+        pool = MirrorPool(mirror_urls("stalled", "backup"), initial_hedge_delay=HEDGE_DELAY)
+        latencies, failures = _run(pool, transport, 1, finished)
+        fetched = time.time()
+        _check(failures == 0, "hedged fetch failed")
+        _check(latencies[0] < STALL_DELAY, f"hedged fetch waited for the stalled mirror ({latencies[0]:.2f}s)")
+        stalled = mirror_urls("stalled")[0]
+        while stalled not in finished and time.time() - fetched < STALL_DELAY:
+            time.sleep(0.01)
+        _check(stalled in finished and finished[stalled] - fetched < STALL_DELAY / 2, "losing request was not cancelled")
+
+        # Tail latency and failure rate: a flaky mirror alone, then with a backup
+        fetches = 30
+        single_pool = MirrorPool(mirror_urls("flaky"), initial_hedge_delay=HEDGE_DELAY, min_samples=3)
+        single, single_failures = _run(single_pool, transport, fetches)
+        _MirrorHandler.request_counts.clear()
+        hedged_pool = MirrorPool(mirror_urls("flaky", "backup"), initial_hedge_delay=HEDGE_DELAY, min_samples=3)
+        hedged, hedged_failures = _run(hedged_pool, transport, fetches)
+        L.info(f"Single mirror: {single_failures}/{fetches} failed, p95 {_p95(single):.2f}s")
+        L.info(f"With backup:   {hedged_failures}/{fetches} failed, p95 {_p95(hedged):.2f}s")
+        _check(single_failures > 0 and hedged_failures == 0, "backup mirror did not remove failures")
+        _check(_p95(single) >= SLOW_DELAY, "flaky mirror alone should have slow answers in its tail")
+        _check(_p95(hedged) < SLOW_DELAY, "backup mirror did not cut the slow answers from the tail")
+
+        # Adaptive ordering: a primary that slows down loses its hedges and drops behind the backup
+        pool = MirrorPool(mirror_urls("degrading", "backup"), initial_hedge_delay=HEDGE_DELAY, min_samples=5)
+        _run(pool, transport, 30)
+        for line in pool.summary():
+            L.info(line)
+        _check(pool.ordered_mirrors()[0] == mirror_urls("backup")[0], "slowed down mirror was not demoted")
+    finally:
+        transport.close()
+        server.shutdown()
+
+    L.info(f"---- All mirror checks passed in {format_time(time.time() - start_time)} ----")
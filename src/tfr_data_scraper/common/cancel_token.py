@@ -0,0 +1,53 @@
+import threading
+from typing import Callable
+
+
+class CancelToken:
+    """
+    A cancellation flag that also runs callbacks when it is set, so that work blocked on I/O (like a request waiting on a
+    socket) can be interrupted instead of only checking the flag between steps.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def set(self) -> None:
+        """ Sets the flag and runs the registered callbacks once.
+        :return: None
+        """
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass  # Cancelling is best effort and must not fail the caller
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """ Registers a callback to run when the token is set. Runs it straight away if the token is already set.
+        :param callback: The callback. Runs on the thread that sets the token.
+        :return: None
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]) -> None:
+        """ Unregisters a callback, e.g. once the work it would cancel has finished.
+        :param callback: The callback.
+        :return: None
+        """
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
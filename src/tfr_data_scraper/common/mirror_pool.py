@@ -0,0 +1,195 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, TypeVar
+
+from common.cancel_token import CancelToken
+from common.logger import Logger as L
+
+T = TypeVar("T")
+
+
+class _MirrorStats:
+    """
+    Observed hit rate and latency of a single mirror.
+    """
+
+    def __init__(self, max_samples: int):
+        self.attempts = 0  # Requests that finished, found or not found
+        self.hits = 0
+        self.lost = 0  # Requests cancelled because another mirror answered first
+        self.latencies = deque(maxlen=max_samples)  # Latencies (seconds) of recent successful and lost requests
+        self.latency_estimate = None  # Peak EWMA of the latencies. Jumps up to a slower sample, decays towards faster ones
+
+    def add_latency(self, latency: float, decay: float = 0.3) -> None:
+        self.latencies.append(latency)
+        if self.latency_estimate is None or latency > self.latency_estimate:
+            self.latency_estimate = latency
+        else:
+            self.latency_estimate += decay * (latency - self.latency_estimate)
+
+    def hit_rate(self) -> float:
+        # Laplace smoothed so that a new mirror starts at 0.5 instead of 0 or 1
+        return (self.hits + 1) / (self.attempts + 2)
+
+    def latency_percentile(self, percentile: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(percentile * len(ordered)))
+        return ordered[index]
+
+
+class MirrorPool:
+    """
+    An ordered list of mirror sites that issues hedged requests across them.
+    The primary mirror is tried first. If it has not answered within its observed latency percentile (or has failed) the
+    request is also sent to the next mirror, and the first successful answer wins while the other requests are cancelled.
+    Mirrors are re-ordered after every request by their expected time per successful request (latency / hit rate). The
+    latency is a peak-sensitive moving average, so a mirror that slows down is demoted as soon as it loses a hedge.
+    """
+
+    def __init__(self, mirrors: list[str], hedge_percentile: float = 0.9, initial_hedge_delay: float = 5.0,
+                 min_samples: int = 5, max_samples: int = 50):
+        """
+        :param mirrors: The mirror base urls in their initial order of preference.
+        :param hedge_percentile: The latency percentile (0-1) of a mirror after which a hedged request is sent to the next mirror.
+        :param initial_hedge_delay: The hedge delay (seconds) to use for a mirror until it has min_samples latencies recorded.
+        :param min_samples: The minimum number of recorded latencies before the percentile is used for the hedge delay.
+        :param max_samples: The number of recent latencies to keep per mirror.
+        """
+        if not mirrors:
+            raise Exception("MirrorPool requires at least one mirror")
+
+        self.hedge_percentile = hedge_percentile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_samples = min_samples
+        self._mirrors = list(mirrors)
+        self._stats = {mirror: _MirrorStats(max_samples) for mirror in mirrors}
+        self._lock = threading.Lock()
+
+    def ordered_mirrors(self) -> list[str]:
+        """ Orders the mirrors by expected time per successful request, lowest first. Ties keep the configured order.
+        :return: The ordered list of mirrors.
+        """
+        with self._lock:
+            return sorted(self._mirrors, key=self._expected_cost)
+
+    def hedge_delay(self, mirror: str) -> float:
+        """ The time to wait on a mirror before sending a hedged request to the next mirror.
+        :param mirror: The mirror base url.
+        :return: The delay in seconds.
+        """
+        with self._lock:
+            stats = self._stats[mirror]
+            if len(stats.latencies) < self.min_samples:
+                return self.initial_hedge_delay
+            return stats.latency_percentile(self.hedge_percentile)
+
+    def record(self, mirror: str, success: bool, latency: float) -> None:
+        """ Records the outcome of a request to a mirror.
+        :param mirror: The mirror base url.
+        :param success: True if the mirror returned the resource.
+        :param latency: The time (seconds) the request took.
+        :return: None
+        """
+        with self._lock:
+            stats = self._stats[mirror]
+            stats.attempts += 1
+            if success:
+                stats.hits += 1
+                stats.add_latency(latency)
+
+    def record_lost(self, mirror: str, elapsed: float | None) -> None:
+        """ Records a request that was cancelled because another mirror answered first. Only affects the latency, not the
+        hit rate, as it is unknown whether the mirror has the resource.
+        :param mirror: The mirror base url.
+        :param elapsed: A lower bound on the mirror's latency, or None if the request says nothing about its latency.
+        :return: None
+        """
+        with self._lock:
+            stats = self._stats[mirror]
+            stats.lost += 1
+            if elapsed is not None:
+                stats.add_latency(elapsed)
+
+    def summary(self) -> list[str]:
+        """ A human-readable line per mirror with its hit rate, lost hedges and latency estimate, in the current order.
+        :return: The summary lines.
+        """
+        lines = []
+        with self._lock:
+            for mirror in sorted(self._mirrors, key=self._expected_cost):
+                stats = self._stats[mirror]
+                latency = stats.latency_estimate
+                latency_text = f"{latency:.2f}s" if latency is not None else "n/a"
+                lines.append(f"{mirror}: {stats.hits}/{stats.attempts} hits, {stats.lost} lost hedges, latency {latency_text}")
+        return lines
+
+    def fetch(self, fetch_fn: Callable[[str, CancelToken], T]) -> T:
+        """ Fetches a resource using hedged requests across the mirrors.
+        :param fetch_fn: Called as fetch_fn(mirror, cancel_token) on a worker thread. Should return the resource or raise
+        on failure. The token is set once the fetch is over; fetch_fn should register a callback on it that aborts any
+        blocking I/O, so the losing requests stop instead of running until their timeout.
+        :return: The result of the first mirror to succeed.
+        :raise: Exception If every mirror failed.
+        """
+        mirrors = self.ordered_mirrors()
+        cancel_token = CancelToken()
+        executor = ThreadPoolExecutor(max_workers=len(mirrors))
+        pending = {}  # future -> (mirror, start time)
+        errors = []
+
+        def launch_next():
+            mirror = mirrors[len(pending) + len(errors)]
+            L.info(f"Requesting from mirror {mirror}")
+            pending[executor.submit(fetch_fn, mirror, cancel_token)] = (mirror, time.time())
+            return mirror
+
+        try:
+            hedge_at = time.time() + self.hedge_delay(launch_next())
+            while pending:
+                has_next = len(pending) + len(errors) < len(mirrors)
+                timeout = max(0.0, hedge_at - time.time()) if has_next else None
+                done, _ = wait(pending.keys(), timeout=timeout, return_when=FIRST_COMPLETED)
+
+                failed = False
+                for future in done:
+                    mirror, started = pending.pop(future)
+                    latency = time.time() - started
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self.record(mirror, False, latency)
+                        failed = True
+                        errors.append(f"{mirror}: {e}")
+                        L.info(f"Mirror {mirror} failed after {latency:.2f}s - {e}")
+                        continue
+
+                    self.record(mirror, True, latency)
+                    L.info(f"Mirror {mirror} answered in {latency:.2f}s")
+
+                    # The losers are about to be cancelled. A loser sent before the winner took at least this long, which
+                    # is a lower bound on its latency. A loser sent after the winner says nothing about its latency.
+                    for loser, loser_started in pending.values():
+                        self.record_lost(loser, time.time() - loser_started if loser_started < started else None)
+                    return result
+
+                # Hedge if the latest mirror is too slow, or fail over immediately if a mirror failed
+                if len(pending) + len(errors) < len(mirrors) and (failed or not pending or time.time() >= hedge_at):
+                    if pending and not failed:
+                        L.info("No answer within hedge delay, sending hedged request")
+                    hedge_at = time.time() + self.hedge_delay(launch_next())
+
+            raise Exception(f"All mirrors failed - {'; '.join(errors)}")
+        finally:
+            cancel_token.set()  # Cancel the losers
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _expected_cost(self, mirror: str) -> float:
+        stats = self._stats[mirror]
+        latency = stats.latency_estimate
+        if latency is None:
+            latency = self.initial_hedge_delay
+        return latency / stats.hit_rate()
@@ -0,0 +1,400 @@
+import importlib.util
+import re
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from common.cancel_token import CancelToken
+from common.constants import Constants as C
+from common.logger import Logger as L
+
+try:
+    import httpx  # Optional. Only needed for HTTP/2 (pip install httpx[http2])
+except ImportError:
+    httpx = None
+if httpx is not None and importlib.util.find_spec("h2") is None:  # httpx only supports http2=True when h2 is installed
+    httpx = None
+
+try:
+    import zstandard as zstd  # Optional. Lets responses use zstd decompression (pip install zstandard)
+except ImportError:
+    zstd = None
+
+try:
+    import brotli  # Optional. Lets responses use br decompression (pip install brotli)
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+_timing = threading.local()  # Per-thread phase timings of the request in flight
+_in_flight = threading.local()  # Per-thread _InFlightRequest of the request in flight
+
+
+def _add_timing(phase: str, seconds: float) -> None:
+    setattr(_timing, phase, getattr(_timing, phase, 0.0) + seconds)
+
+
+class _DnsCache:
+    """
+    Cache of DNS lookups for the connections of one Transport. Also records the DNS lookup time of the request in flight.
+    getaddrinfo does not expose the record's own TTL, so entries are kept for a fixed ttl.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (host, port) -> (expiry time, address), least recently used first
+
+    def resolve(self, host: str, port: int) -> str:
+        """ Resolves a host name to an IP address, using the cached address until it expires.
+        :param host: The host name (or IP address).
+        :param port: The port that will be connected to.
+        :return: The IP address.
+        :raise: socket.gaierror If the host name can't be resolved.
+        """
+        key = (host, port)
+        start = time.perf_counter()
+        try:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry[0] > time.time():
+                    self._entries.move_to_end(key)
+                    return entry[1]
+
+            address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][4][0]
+            with self._lock:
+                self._entries[key] = (time.time() + self.ttl, address)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return address
+        finally:
+            _add_timing("dns", time.perf_counter() - start)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def _timed_connect(connect, *args, **kwargs):
+    # Connect time excludes the DNS lookup done as part of connecting
+    dns_before = getattr(_timing, "dns", 0.0)
+    start = time.perf_counter()
+    result = connect(*args, **kwargs)
+    _add_timing("connect", time.perf_counter() - start - (getattr(_timing, "dns", 0.0) - dns_before))
+    return result
+
+
+def _cached_new_conn(connection, new_conn):
+    # Open the socket to the cached address. Only _dns_host is swapped, so TLS (SNI and certificate checks) still uses the host name
+    host = connection._dns_host
+    connection._dns_host = connection.dns_cache.resolve(host, connection.port)
+    try:
+        return new_conn()
+    finally:
+        connection._dns_host = host
+
+
+class _InFlightRequest:
+    """
+    The connection a request is using, so that another thread can cancel the request while it is blocked on the socket.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.connection = None
+        self.cancelled = False
+
+    def use(self, connection) -> None:
+        # Called on the request's thread before sending. Checks cancelled after publishing the connection, so either this
+        # sees the cancel or cancel() sees the connection
+        self.connection = connection
+        if self.cancelled:
+            raise Exception(f"Request to {self.url} cancelled")
+
+    def cancel(self) -> None:
+        # Called on the cancelling thread. Shutting the socket down wakes up a read blocked on it
+        self.cancelled = True
+        sock = getattr(self.connection, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # Already closed
+
+
+def _track_connection(connection) -> None:
+    in_flight = getattr(_in_flight, "request", None)
+    if in_flight is not None:
+        in_flight.use(connection)
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    dns_cache = None  # Set on the per-adapter subclass
+
+    def connect(self):
+        return _timed_connect(super().connect)
+
+    def request(self, *args, **kwargs):
+        _track_connection(self)
+        return super().request(*args, **kwargs)
+
+    def _new_conn(self):
+        return _cached_new_conn(self, super()._new_conn)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    dns_cache = None  # Set on the per-adapter subclass
+
+    def connect(self):
+        return _timed_connect(super().connect)
+
+    def request(self, *args, **kwargs):
+        _track_connection(self)
+        return super().request(*args, **kwargs)
+
+    def _new_conn(self):
+        return _cached_new_conn(self, super()._new_conn)
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections resolve through the transport's DNS cache and record their connect (TCP + TLS) time.
+    """
+
+    def __init__(self, dns_cache: _DnsCache, **kwargs):
+        self._dns_cache = dns_cache  # Needed by init_poolmanager, which HTTPAdapter.__init__ calls
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        http_connection = type("_TimedHTTPConnection", (_TimedHTTPConnection,), {"dns_cache": self._dns_cache})
+        https_connection = type("_TimedHTTPSConnection", (_TimedHTTPSConnection,), {"dns_cache": self._dns_cache})
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": type("_TimedHTTPConnectionPool", (HTTPConnectionPool,), {"ConnectionCls": http_connection}),
+            "https": type("_TimedHTTPSConnectionPool", (HTTPSConnectionPool,), {"ConnectionCls": https_connection})
+        }
+
+
+class _CachedNetworkBackend:
+    """
+    httpcore network backend that resolves through the transport's DNS cache. Everything else goes to the wrapped backend.
+    """
+
+    def __init__(self, backend, dns_cache: _DnsCache):
+        self._backend = backend
+        self._dns_cache = dns_cache
+
+    def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        return self._backend.connect_tcp(self._dns_cache.resolve(host, port), port, timeout, local_address, socket_options)
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+
+def _httpx_trace(event_name: str, info: dict) -> None:
+    # httpcore trace hook used to time the connect (TCP + TLS) phase of HTTP/2 requests
+    if event_name in ("connection.connect_tcp.started", "connection.start_tls.started"):
+        _timing.connect_started = time.perf_counter()
+        _timing.dns_at_connect = getattr(_timing, "dns", 0.0)
+    elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+        dns_during_connect = getattr(_timing, "dns", 0.0) - _timing.dns_at_connect
+        _add_timing("connect", time.perf_counter() - _timing.connect_started - dns_during_connect)
+
+
+class ResponseTooLarge(Exception):
+    """
+    Raised when a (decompressed) response body exceeds the transport's maximum response size.
+    """
+
+
+class RequestTiming:
+    """
+    The time (seconds) spent in each phase of a request. dns and connect are 0 when a cached lookup or pooled connection is used.
+    """
+
+    def __init__(self, dns: float, connect: float, ttfb: float, download: float):
+        self.dns = dns  # Resolving the host name
+        self.connect = connect  # Opening the TCP connection and TLS handshake
+        self.ttfb = ttfb  # Sending the request until the response headers arrive
+        self.download = download  # Reading and decompressing the body
+        self.total = dns + connect + ttfb + download
+
+    def __str__(self):
+        return (f"dns {self.dns:.3f}s, connect {self.connect:.3f}s, ttfb {self.ttfb:.3f}s, "
+                f"download {self.download:.3f}s, total {self.total:.3f}s")
+
+
+class Response:
+    """
+    A fully read response.
+    """
+
+    def __init__(self, url: str, status_code: int, headers: dict[str, str], content: bytes, timing: RequestTiming):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.timing = timing
+
+    @property
+    def text(self) -> str:
+        match = re.search(r"charset=[\"']?([\w-]+)", self.headers.get("content-type", ""))
+        encoding = match.group(1) if match else "utf-8"
+        try:
+            return self.content.decode(encoding, errors="replace")
+        except LookupError:  # Unknown charset
+            return self.content.decode("utf-8", errors="replace")
+
+    def raise_for_status(self) -> None:
+        """ Raises an exception for 4XX/5XX responses
+        :return: None
+        :raise: Exception If the status code is 4XX or 5XX
+        """
+        if 400 <= self.status_code < 600:
+            raise Exception(f"{self.status_code} error for url: {self.url}")
+
+
+class Transport:
+    """
+    Shared HTTP transport for the scraping scripts. Keeps a pool of keep-alive connections (optionally multiplexed over
+    HTTP/2), caches DNS lookups, streams and decompresses bodies up to a maximum size, and times each phase of a request.
+    """
+
+    _CHUNK_SIZE = 16 * 1024
+
+    def __init__(self, referrer: str, timeout: float = 30, max_response_bytes: int = 10 * 1024 * 1024,
+                 pool_maxsize: int = 10, http2: bool = False, dns_cache_ttl: float = 300):
+        """
+        :param referrer: The referrer sent with the default headers.
+        :param timeout: The connect and read timeout (seconds).
+        :param max_response_bytes: The maximum size of a decompressed body. Larger bodies raise ResponseTooLarge.
+        :param pool_maxsize: The maximum number of kept-alive connections per host.
+        :param http2: Use HTTP/2 when the server supports it. Requires httpx[http2]; falls back to HTTP/1.1 otherwise.
+        :param dns_cache_ttl: The time (seconds) to cache DNS lookups for.
+        """
+        self.timeout = timeout
+        self.max_response_bytes = max_response_bytes
+        self._headers = C.get_headers(referrer)
+        # Don't ask for an encoding that can't be decompressed
+        missing = {encoding for encoding, module in (("br", brotli), ("zstd", zstd)) if module is None}
+        encodings = [encoding.strip() for encoding in self._headers["Accept-Encoding"].split(",")]
+        self._headers["Accept-Encoding"] = ", ".join(encoding for encoding in encodings if encoding not in missing)
+        self._lock = threading.Lock()
+        self._num_requests = 0
+        self._phase_totals = {"dns": 0.0, "connect": 0.0, "ttfb": 0.0, "download": 0.0}
+
+        self._dns_cache = _DnsCache(dns_cache_ttl)
+
+        if http2 and httpx is None:
+            L.info("httpx[http2] is not installed. Falling back to HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+
+        if http2:
+            limits = httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize)
+            headers = {key: value for key, value in self._headers.items() if key != "Connection"}  # Not allowed in HTTP/2
+            transport = httpx.HTTPTransport(http2=True, limits=limits)
+            # httpx has no public resolver hook, so wrap the network backend of its connection pool
+            transport._pool._network_backend = _CachedNetworkBackend(transport._pool._network_backend, self._dns_cache)
+            self._client = httpx.Client(transport=transport, headers=headers, timeout=timeout, follow_redirects=True)
+        else:
+            adapter = _TimedHTTPAdapter(self._dns_cache, pool_connections=pool_maxsize, pool_maxsize=pool_maxsize,
+                                        max_retries=0)
+            self._client = requests.Session()
+            self._client.headers.update(self._headers)
+            self._client.mount("http://", adapter)
+            self._client.mount("https://", adapter)
+
+    def get(self, url: str, headers: dict[str, str] | None = None, cancel_token: CancelToken | None = None) -> Response:
+        """ Performs a GET request and reads the whole (decompressed) body.
+        :param url: The url to request.
+        :param headers: Headers to send in addition to (or overriding) the default headers.
+        :param cancel_token: When set, aborts the request. Over HTTP/1.1 the connection is closed, which also interrupts
+        waiting for the response. Over HTTP/2 the connection is shared, so the request stops once the response headers arrive.
+        :return: The response.
+        :raise: ResponseTooLarge If the decompressed body is larger than max_response_bytes.
+        :raise: Exception On network errors or if the request was cancelled.
+        """
+        _timing.dns = 0.0
+        _timing.connect = 0.0
+        in_flight = _InFlightRequest(url)
+        _in_flight.request = in_flight
+        if cancel_token is not None:
+            cancel_token.add_callback(in_flight.cancel)
+        start = time.perf_counter()
+
+        try:
+            if in_flight.cancelled:
+                raise Exception(f"Request to {url} cancelled")
+
+            if self.http2:
+                with self._client.stream("GET", url, headers=headers, extensions={"trace": _httpx_trace}) as response:
+                    headers_received = time.perf_counter()
+                    content = self._read_body(in_flight, response.iter_bytes(self._CHUNK_SIZE))
+                    status_code, response_headers, final_url = response.status_code, dict(response.headers), str(response.url)
+            else:
+                with self._client.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                    headers_received = time.perf_counter()
+                    content = self._read_body(in_flight, response.iter_content(self._CHUNK_SIZE))
+                    status_code, response_headers, final_url = response.status_code, dict(response.headers), response.url
+        except Exception:
+            if in_flight.cancelled:
+                raise Exception(f"Request to {url} cancelled")
+            raise
+        finally:
+            _in_flight.request = None
+            if cancel_token is not None:
+                cancel_token.remove_callback(in_flight.cancel)
+
+        end = time.perf_counter()
+        dns, connect = _timing.dns, _timing.connect
+        timing = RequestTiming(dns, connect, max(0.0, headers_received - start - dns - connect), end - headers_received)
+        self._record(timing)
+
+        # Header lookups are case-insensitive on the underlying responses; normalize so Response can rely on lowercase keys
+        response_headers = {key.lower(): value for key, value in response_headers.items()}
+        return Response(final_url, status_code, response_headers, content, timing)
+
+    def summary(self) -> str:
+        """ The average time spent in each phase over all requests made.
+        :return: A human-readable summary.
+        """
+        with self._lock:
+            if self._num_requests == 0:
+                return "No requests made"
+            averages = {phase: total / self._num_requests for phase, total in self._phase_totals.items()}
+        return (f"{self._num_requests} requests. Averages: dns {averages['dns']:.3f}s, connect {averages['connect']:.3f}s, "
+                f"ttfb {averages['ttfb']:.3f}s, download {averages['download']:.3f}s")
+
+    def close(self) -> None:
+        self._client.close()
+        self._dns_cache.clear()
+
+    def _read_body(self, in_flight: _InFlightRequest, chunks) -> bytes:
+        # The chunks are already decompressed, so the cap applies to the decompressed size
+        body = bytearray()
+        for chunk in chunks:
+            if in_flight.cancelled:
+                raise Exception(f"Request to {in_flight.url} cancelled")
+            body += chunk
+            if len(body) > self.max_response_bytes:
+                raise ResponseTooLarge(f"Response from {in_flight.url} is larger than {self.max_response_bytes} bytes")
+        return bytes(body)
+
+    def _record(self, timing: RequestTiming) -> None:
+        with self._lock:
+            self._num_requests += 1
+            self._phase_totals["dns"] += timing.dns
+            self._phase_totals["connect"] += timing.connect
+            self._phase_totals["ttfb"] += timing.ttfb
+            self._phase_totals["download"] += timing.download
@@ -4,16 +4,14 @@ from typing import Tuple
 from urllib.parse import urljoin
 
 from bs4 import BeautifulSoup
-import requests
 import time
 import random
-import zstandard as zstd  # Download this library so requests will use zstd decompression
 from dotenv import load_dotenv
 
 from common.database import Database as DB
-from common.constants import Constants as C
 from common.logger import Logger as L
 from common.time_helper import format_time, estimate_time_remaining
+from common.transport import Transport
 
 
 def _update_url_page_number(page_url: str) -> (str, int):
@@ -78,11 +76,12 @@ if __name__ == "__main__":
     min_seeds = 1  # minimum number of seeds to be considered valid
     sleep_time_seconds = 15  # Sleep time between processing subsequent pages.
     sleep_time_jiggle = 5  # Jiggle time + and -. The actual sleep time will be randomly between sleep_time_seconds + or - this time.
+    max_response_bytes = 5 * 1024 * 1024  # The maximum (decompressed) page size. Larger pages count as a fail.
+    use_http2 = False  # Use HTTP/2 when the site supports it. Requires httpx[http2].
 
     # -- SCRIPT --
     DB.create_db()
-    session = requests.Session()
-    session.headers.update(C.get_headers(base_site))
+    transport = Transport(base_site, timeout=30, max_response_bytes=max_response_bytes, http2=use_http2)
 
     pages_processed = 0
     current_page_num = 0
@@ -96,8 +95,9 @@ if __name__ == "__main__":
             L.info(f"Processing Url {url}")
 
             # Get Page
-            response = session.get(url, timeout=30)
+            response = transport.get(url)
             L.info(f"Status code: {response.status_code}")
+            L.info(f"Timing: {response.timing}")
             response.raise_for_status()  # Raise exception for 4XX/5XX responses
 
             # Scrape Page
@@ -125,5 +125,7 @@ if __name__ == "__main__":
     L.info(f"Results: ")
     L.info(f"{total_hrefs_added} Hrefs added to DB.")
     L.info(f"{pages_processed} pages successfully processed.")
+    L.info(f"Requests: {transport.summary()}")
+    transport.close()
     L.info(f'{L.num_errors} errors occurred:')
     L.print_error_messages()
@@ -3,17 +3,15 @@ import traceback
 from urllib.parse import urljoin
 
 from bs4 import BeautifulSoup
-import requests
 import time
 import random
 import re
-import zstandard as zstd  # Download this library so requests will use zstd decompression
 from dotenv import load_dotenv
 
 from common.database import Database as DB
-from common.constants import Constants as C
 from common.time_helper import format_time, estimate_time_remaining
 from common.logger import Logger as L
+from common.transport import Transport
 
 if __name__ == "__main__":
     # -- CONFIG --
@@ -26,10 +24,11 @@ if __name__ == "__main__":
     max_fails = 3  # The maximum number of fails before stopping. Fails include network issues, page not found, and no links found.
     sleep_time_seconds = 10  # Sleep time between processing subsequent pages.
     sleep_time_jiggle = 3  # Jiggle time + and -. The actual sleep time will be randomly between sleep_time_seconds + or - this time.
+    max_response_bytes = 5 * 1024 * 1024  # The maximum (decompressed) page size. Larger pages count as a fail.
+    use_http2 = False  # Use HTTP/2 when the site supports it. Requires httpx[http2].
 
     # -- SCRIPT --
-    session = requests.Session()
-    session.headers.update(C.get_headers(base_site))
+    transport = Transport(base_site, timeout=30, max_response_bytes=max_response_bytes, http2=use_http2)
     hrefs = DB.get_hrefs_without_magnet_links()
     if shuffle:
         random.shuffle(hrefs)
@@ -44,8 +43,9 @@ if __name__ == "__main__":
             L.info(f"Processing Url {url}")
 
             # Get request
-            response = session.get(url, timeout=30)
+            response = transport.get(url)
             L.info(f"Status code: {response.status_code}")
+            L.info(f"Timing: {response.timing}")
             response.raise_for_status()  # Raise exception for 4XX/5XX responses
 
             # Extract the magnet link
@@ -76,5 +76,7 @@ if __name__ == "__main__":
     L.info(f"Run time: {format_time(time.time()-start_time)}")
     L.info(f"Results: ")
     L.info(f"{total_links} Links added to DB.")
+    L.info(f"Requests: {transport.summary()}")
+    transport.close()
     L.info(f'{L.num_errors} errors occurred:')
     L.print_error_messages()
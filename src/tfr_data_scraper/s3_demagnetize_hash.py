@@ -1,6 +1,5 @@
 import os
 import re
-import subprocess
 import time
 import random
 import traceback
@@ -9,47 +8,60 @@ from urllib.parse import urljoin
 from dotenv import load_dotenv
 from pathlib import Path
 
+from common.cancel_token import CancelToken
 from common.database import Database as DB
 from common.constants import Constants as C
 from common.time_helper import estimate_time_remaining, format_time
 from common.logger import Logger as L
+from common.mirror_pool import MirrorPool
+from common.transport import Transport
 
 
-def _get_torrent(h: str, source: str, output_dir: Path) -> str:
-    """ Downloads the torrent from the source site and saves it to the output_dir
+def _download_torrent(h: str, source: str, transport: Transport, cancel_token: CancelToken) -> bytes:
+    """ Downloads the torrent from a single cache site into memory
     :param h: The hash of the torrent file
     :param source: The cache site to download the .torrent file from
+    :param transport: The transport to download with
+    :param cancel_token: Set when another mirror has already answered; aborts the download
+    :return: The contents of the .torrent file
+    :raise: Exception If the .torrent file was unable to be downloaded or the download was cancelled.
+    """
+
+    url = urljoin(source, f"{h}.torrent")
+    L.info(f"Downloading: {url}")
+
+    response = transport.get(url, headers={"Referer": source}, cancel_token=cancel_token)
+    L.info(f"Timing: {response.timing}")
+    response.raise_for_status()  # Raise exception for 4XX/5XX responses
+
+    content = response.content
+    if not content.startswith(b"d"):  # A .torrent file is a bencoded dictionary. Some caches return an html page instead.
+        raise Exception(f"Response from {url} is not a torrent file")
+
+    return content
+
+
+def _get_torrent(h: str, mirrors: MirrorPool, transport: Transport, output_dir: Path) -> Path:
+    """ Downloads the torrent from the fastest answering cache mirror and saves it to the output_dir
+    :param h: The hash of the torrent file
+    :param mirrors: The cache mirrors to download the .torrent file from
+    :param transport: The transport to download with
     :param output_dir: The output directory to save the .torrent files to
     :return: The output path of the .torrent file
-    :raise: Exception If the .torrent file was unable to be downloaded.
+    :raise: Exception If the .torrent file was unable to be downloaded from any mirror.
     """
 
     # Create output dir
     os.makedirs(output_dir, exist_ok=True)
 
-    url = urljoin(source, f"{h}.torrent")
     output_path = output_dir / f"{h}.torrent"
     if os.path.exists(output_path):
         L.info(f"Torrent file {output_path} already exists")
         os.remove(output_path)  # For now lets delete the file and redownload it
 
-    L.info(f"Downloading: {url}")
-
-    # PowerShell command to use Invoke-WebRequest to download torrent
-    powershell_cmd = f"powershell -Command \"try {{ Invoke-WebRequest -Uri '{url}' -OutFile '{output_path}' -TimeoutSec 10 }} catch {{ Write-Host 'ERROR: ' + $_.Exception.Message; exit 1 }}\""
-
-    result = subprocess.run(powershell_cmd, shell=True, capture_output=True, text=True)
-
-    # Check for failure
-    if result.returncode != 0:
-        message = result.stderr or result.stdout
-        raise Exception(f"Unable to download torrent file - {message}")
-
-    # Ensure file was actually created
-    if os.path.exists(output_path):
-        L.info("File was created successfully.")
-    else:
-        raise Exception(f"Torrent file {output_path} was not created")
+    content = mirrors.fetch(lambda source, cancel_token: _download_torrent(h, source, transport, cancel_token))
+    with open(output_path, "wb") as f:
+        f.write(content)
     L.info("Download successful")
 
     return output_path
@@ -68,16 +80,24 @@ def _extract_magnet_hash(magnet_link: str) -> str | None:
 if __name__ == "__main__":
     # -- CONFIG --
     load_dotenv()
-    base_site = os.getenv("DEMAGNETIZE_BASE_SITE")
+    base_site = os.getenv("DEMAGNETIZE_BASE_SITE")  # Comma separated list of cache mirrors, in order of preference
     if base_site is None:
         raise Exception("DEMAGNETIZE_BASE_SITE. Make sure to create a .env with DEMAGNETIZE_BASE_SITE and update demagnetize script for that site")
+    mirror_sites = [site.strip() for site in base_site.split(",") if site.strip()]
 
     shuffle = True  # Shuffle the rows before processing.
     max_fails = 3  # The maximum number of fails before stopping. Fails include network issues, page not found, and no links found.
     sleep_time_seconds = 10  # Sleep time between processing subsequent pages.
     sleep_time_jiggle = 5  # Jiggle time + and -. The actual sleep time will be randomly between sleep_time_seconds + or - this time.
+    hedge_percentile = 0.9  # Send a hedged request to the next mirror once the current one is slower than this percentile of its latencies.
+    initial_hedge_delay = 5  # Hedge delay (seconds) used for a mirror until enough of its latencies have been observed.
+    max_response_bytes = 10 * 1024 * 1024  # The maximum (decompressed) torrent file size. Larger files count as a fail.
+    use_http2 = False  # Use HTTP/2 when the site supports it. Requires httpx[http2].
 
     # -- SCRIPT --
+    mirrors = MirrorPool(mirror_sites, hedge_percentile=hedge_percentile, initial_hedge_delay=initial_hedge_delay)
+    transport = Transport(mirror_sites[0], timeout=10, max_response_bytes=max_response_bytes, http2=use_http2,
+                          pool_maxsize=max(10, len(mirror_sites)))
     rows = DB.get_magnet_links_without_torrent()
     if shuffle:
         random.shuffle(rows)
@@ -91,7 +111,7 @@ if __name__ == "__main__":
             tor_hash = _extract_magnet_hash(magnet_link)
             if tor_hash:
                 # Download Torrent from cache site; saving to Torrent folder path
-                torrent_file_path = _get_torrent(tor_hash, base_site, C.TORRENT_FOLDER_PATH)
+                torrent_file_path = _get_torrent(tor_hash, mirrors, transport, C.TORRENT_FOLDER_PATH)
                 L.info(f'Extracted {torrent_file_path.name} from {tor_hash}')
 
                 # Save details in database
@@ -116,5 +136,10 @@ if __name__ == "__main__":
     L.info(f"Run time: {format_time(time.time() - start_time)}")
     L.info(f"Results: ")
     L.info(f"{total_demagnetized} Torrent Demagnetized")
+    L.info(f"Requests: {transport.summary()}")
+    transport.close()
+    L.info("Mirrors: ")
+    for line in mirrors.summary():
+        L.info(line)
     L.info(f'{L.num_errors} errors occurred:')
     L.print_error_messages()